@@ -0,0 +1,46 @@
+# cython: language_level=3
+"""
+Compiled version of split_resorts.group_features.
+
+Optional: split_resorts.py uses it when it has been built, and falls back
+to the pure-Python loop otherwise. Build with:
+
+    cythonize -3 -i Scripts/_grouping.pyx
+"""
+
+
+def group_features(features, dict resort_index_map, list by_area):
+    """Append each run or lift feature to the list of every resort it belongs to.
+
+    Returns the number of features seen and the number of orphans, i.e.
+    features that matched no downhill resort.
+    """
+    cdef Py_ssize_t count = 0
+    cdef Py_ssize_t orphans = 0
+    cdef Py_ssize_t idx
+    cdef bint matched
+    cdef object feature, props, ski_areas, sa, sa_props, found
+
+    for feature in features:
+        count += 1
+        props = (<dict?>feature).get("properties")
+        ski_areas = (<dict?>props).get("skiAreas") if props else None
+        if not ski_areas:
+            orphans += 1
+            continue
+
+        matched = False
+        for sa in ski_areas:
+            if not isinstance(sa, dict):
+                continue
+            sa_props = (<dict>sa).get("properties")
+            if not sa_props:
+                continue
+            found = resort_index_map.get((<dict?>sa_props).get("id"))
+            if found is not None:
+                idx = found
+                (<list>by_area[idx]).append(feature)
+                matched = True
+        if not matched:
+            orphans += 1
+    return count, orphans
@@ -6,21 +6,43 @@ Downloads ski_areas, runs, and lifts GeoJSON from OpenSkiMap,
 groups runs/lifts by ski area ID, and writes:
   - dist/{resort_id}.json.gz  (per-resort bundle with resort + runs + lifts)
   - dist/resort_index.json    (lightweight catalog of all resorts)
+  - dist/resort_index_v2.json (the same catalog in columnar form)
 
 Usage:
-    python3 Scripts/split_resorts.py [--output dist] [--skip-download]
+    python3 Scripts/split_resorts.py [--output dist] [--skip-download] [--workers N]
 """
 
 import json
-import gzip
 import os
+import shutil
 import sys
 import time
 import argparse
+import mmap
+import multiprocessing
+import urllib.error
 import urllib.request
-from collections import defaultdict
+import zlib
+from collections import Counter
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib json module
+    orjson = None
+
+try:
+    import ijson  # picks the C (yajl2_c) backend when it is available
+except ImportError:  # optional: falls back to loading whole files
+    ijson = None
+
+# Shared read-only default for missing "properties" objects, so lookups in
+# the per-feature loops don't allocate a fresh {} each time
+_EMPTY: dict = {}
+
 BASE_URL = "https://tiles.openskimap.org/geojson"
 FILES = {
     "ski_areas": f"{BASE_URL}/ski_areas.geojson",
@@ -30,66 +52,206 @@ FILES = {
 
 DOWNLOAD_DIR = Path("/tmp/openskidata")
 DEFAULT_OUTPUT = Path("dist")
-
-
-def download_file(url: str, dest: Path) -> None:
-    """Download a file with progress reporting."""
+DOWNLOAD_PARTS = 8  # parallel byte ranges per file
+CHUNK_SIZE = 4 * 1024 * 1024  # 4MB network reads
+WRITE_BUFFER_SIZE = 8 * 1024 * 1024  # 8MB file buffer for streamed downloads
+
+# gzip defaults to level 9, which is much slower than 6 for a marginally
+# better ratio on GeoJSON
+GZIP_LEVEL = 6
+
+# Gzip-format (wbits=31) compressor that each bundle copies instead of
+# setting up a new GzipFile and DEFLATE state from scratch
+GZIP_COMPRESSOR = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+COMPRESS_SLICE_SIZE = 1024 * 1024  # feed the compressor 1MB at a time
+
+# Fields of resort_index_v2.json; elevations are null when a resort has no statistics
+INDEX_COLUMNS = (
+    "id",
+    "name",
+    "latitude",
+    "longitude",
+    "runCount",
+    "liftCount",
+    "difficulty",
+    "status",
+    "maxElevation",
+    "minElevation",
+)
+
+# Ski area properties kept in each bundle's "resort" feature; the rest
+# (websites, sources, location metadata, ...) isn't used by the app
+SKI_AREA_PROP_WHITELIST = {"id", "name", "status", "runConvention", "statistics", "activities"}
+
+
+def json_loads(data: bytes | memoryview) -> object:
+    """Parse JSON bytes, using orjson when available."""
+    if orjson is not None:
+        return orjson.loads(data)
+    # The stdlib parser needs str or bytes, so memoryviews are copied
+    return json.loads(bytes(data))
+
+
+def json_dumps(obj: object) -> bytes:
+    """Serialize to compact UTF-8 JSON bytes, using orjson when available."""
+    if orjson is not None:
+        # Difficulty breakdowns can be keyed by None; stdlib json writes "null"
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def open_url(url: str, headers: dict | None = None, method: str | None = None):
+    """Open a URL with the Carvable User-Agent."""
+    req = urllib.request.Request(
+        url, headers={"User-Agent": "Carvable/1.0", **(headers or {})}, method=method
+    )
+    return urllib.request.urlopen(req, timeout=600)
+
+
+def download_stream(url: str, dest: Path) -> None:
+    """Download a file over a single connection."""
+    with open_url(url) as response, open(dest, "wb", buffering=WRITE_BUFFER_SIZE) as f:
+        shutil.copyfileobj(response, f, CHUNK_SIZE)
+
+
+def download_range(url: str, fd: int, first: int, last: int) -> bool:
+    """Write bytes first..last of a file into fd at the same offsets.
+
+    Returns False if the server ignored the Range header.
+    """
+    with open_url(url, headers={"Range": f"bytes={first}-{last}"}) as response:
+        if response.status != 206:
+            return False
+        offset = first
+        while True:
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            os.pwrite(fd, chunk, offset)
+            offset += len(chunk)
+
+    if offset != last + 1:
+        raise urllib.error.ContentTooShortError(
+            f"Range {first}-{last} of {url} ended at byte {offset}", None
+        )
+    return True
+
+
+def download_ranged(url: str, dest: Path, total: int, parts: int) -> bool:
+    """Download a file as parallel byte ranges.
+
+    Returns False if the server does not honour range requests.
+    """
+    part_size = -(-total // parts)
+    ranges = [(first, min(first + part_size, total) - 1) for first in range(0, total, part_size)]
+
+    fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.ftruncate(fd, total)
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            results = list(executor.map(lambda r: download_range(url, fd, *r), ranges))
+    finally:
+        os.close(fd)
+    return all(results)
+
+
+def download_file(url: str, dest: Path, parts: int = DOWNLOAD_PARTS) -> None:
+    """Download a file, logging when it starts and finishes.
+
+    Large files are fetched as parallel byte ranges when the server
+    supports it, falling back to a single stream otherwise.
+    """
     if dest.exists():
         size_mb = dest.stat().st_size / (1024 * 1024)
-        print(f"  Already downloaded: {dest.name} ({size_mb:.1f} MB)")
+        sys.stdout.write(f"  Already downloaded: {dest.name} ({size_mb:.1f} MB)\n")
         return
 
     dest.parent.mkdir(parents=True, exist_ok=True)
-    print(f"  Downloading {url}...")
+    # Downloads run in parallel threads; write whole lines so they don't interleave
+    sys.stdout.write(f"  Downloading {url}...\n")
     start = time.time()
 
-    req = urllib.request.Request(url, headers={"User-Agent": "Carvable/1.0"})
-    with urllib.request.urlopen(req, timeout=600) as response:
-        total = int(response.headers.get("Content-Length", 0))
-        downloaded = 0
-        chunk_size = 1024 * 1024  # 1MB chunks
-
-        with open(dest, "wb") as f:
-            while True:
-                chunk = response.read(chunk_size)
-                if not chunk:
-                    break
-                f.write(chunk)
-                downloaded += len(chunk)
-                if total > 0:
-                    pct = downloaded / total * 100
-                    print(f"\r  {downloaded / (1024*1024):.1f} / {total / (1024*1024):.1f} MB ({pct:.0f}%)", end="", flush=True)
-                else:
-                    print(f"\r  {downloaded / (1024*1024):.1f} MB", end="", flush=True)
+    # Download under a temporary name so an interrupted run isn't mistaken
+    # for a finished file by the exists() check above
+    partial = dest.with_name(f"{dest.name}.part")
+    try:
+        with open_url(url, method="HEAD") as response:
+            total = int(response.headers.get("Content-Length", 0))
+    except urllib.error.HTTPError:
+        total = 0  # HEAD rejected (e.g. 405/403); a plain GET may still work
+    if total < parts * CHUNK_SIZE or not download_ranged(url, partial, total, parts):
+        download_stream(url, partial)
+    partial.replace(dest)
 
     elapsed = time.time() - start
     size_mb = dest.stat().st_size / (1024 * 1024)
-    print(f"\n  Done: {size_mb:.1f} MB in {elapsed:.0f}s")
+    sys.stdout.write(f"  Done: {dest.name} ({size_mb:.1f} MB in {elapsed:.0f}s)\n")
 
 
 def load_geojson(path: Path) -> dict:
     """Load and parse a GeoJSON file."""
     print(f"  Parsing {path.name}...")
     start = time.time()
-    with open(path, "r") as f:
-        data = json.load(f)
+    # Parse straight from a read-only mapping of the file rather than
+    # copying it into a Python bytes object first
+    with open(path, "rb") as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            data = json_loads(view)
     elapsed = time.time() - start
     count = len(data.get("features", []))
     print(f"  Parsed {count:,} features in {elapsed:.1f}s")
     return data
 
 
-def extract_ski_area_ids(feature: dict) -> list[str]:
-    """Extract ski area IDs from a run or lift feature."""
-    ski_areas = feature.get("properties", {}).get("skiAreas", [])
-    ids = []
-    for sa in ski_areas:
-        if isinstance(sa, dict):
-            props = sa.get("properties", {})
-            sa_id = props.get("id")
-            if sa_id:
-                ids.append(sa_id)
-    return ids
+def iter_features(path: Path) -> Iterator[dict]:
+    """Yield the features of a GeoJSON FeatureCollection one at a time."""
+    if ijson is None:
+        yield from load_geojson(path)["features"]
+        return
+
+    print(f"  Streaming {path.name}...")
+    with open(path, "rb") as f:
+        yield from ijson.items(f, "features.item", use_float=True)
+
+
+def group_features(
+    features: Iterator[dict], resort_index_map: dict[str, int], by_area: list[list[dict]]
+) -> tuple[int, int]:
+    """Append each run or lift feature to the list of every resort it belongs to.
+
+    Returns the number of features seen and the number of orphans, i.e.
+    features that matched no downhill resort.
+    """
+    lookup = resort_index_map.get  # bound once; called per ski area reference
+    count = 0
+    orphans = 0
+    for feature in features:
+        count += 1
+        ski_areas = (feature.get("properties") or _EMPTY).get("skiAreas")
+        if not ski_areas:
+            orphans += 1
+            continue
+
+        matched = False
+        for sa in ski_areas:
+            if not isinstance(sa, dict):
+                continue
+            idx = lookup((sa.get("properties") or _EMPTY).get("id"))
+            if idx is not None:
+                by_area[idx].append(feature)
+                matched = True
+        if not matched:
+            orphans += 1
+    return count, orphans
+
+
+try:
+    # Optional compiled version of the loop above; see Scripts/_grouping.pyx
+    from _grouping import group_features as _compiled_group_features
+except ImportError:
+    _compiled_group_features = None
 
 
 def get_resort_location(feature: dict) -> tuple[float, float] | None:
@@ -105,8 +267,9 @@ def get_resort_location(feature: dict) -> tuple[float, float] | None:
         return (coords[1], coords[0])  # lat, lng
     elif geom_type == "Polygon" and coords and coords[0]:
         ring = coords[0]
-        avg_lng = sum(c[0] for c in ring) / len(ring)
-        avg_lat = sum(c[1] for c in ring) / len(ring)
+        # map/itemgetter keeps the summation loop in C
+        avg_lng = sum(map(itemgetter(0), ring)) / len(ring)
+        avg_lat = sum(map(itemgetter(1), ring)) / len(ring)
         return (avg_lat, avg_lng)
 
     return None
@@ -114,17 +277,104 @@ def get_resort_location(feature: dict) -> tuple[float, float] | None:
 
 def compute_difficulty_breakdown(runs: list[dict]) -> dict[str, int]:
     """Count runs by difficulty level."""
-    counts = defaultdict(int)
-    for run in runs:
-        diff = run.get("properties", {}).get("difficulty", "other")
-        counts[diff] += 1
-    return dict(counts)
+    # Counter counts an iterable in C rather than a Python-level loop
+    return dict(Counter((run.get("properties") or _EMPTY).get("difficulty", "other") for run in runs))
+
+
+def iter_bundle_tasks(
+    active: list[int],
+    resort_ids: list[str],
+    resort_features: list[dict],
+    resort_names: list[str],
+    resort_locations: list[tuple[float, float] | None],
+    runs_by_area: list[list[dict]],
+    lifts_by_area: list[list[dict]],
+    output_dir: Path,
+) -> Iterator[tuple]:
+    """Yield write_bundle tasks for the resorts at the given indices.
+
+    Each resort's runs and lifts are cleared from the grouping lists so
+    they can be freed once the task has been handed to a worker.
+    """
+    for idx in active:
+        runs = runs_by_area[idx]
+        lifts = lifts_by_area[idx]
+        runs_by_area[idx] = lifts_by_area[idx] = None
+
+        yield (
+            idx,
+            resort_ids[idx],
+            resort_features[idx],
+            resort_names[idx],
+            resort_locations[idx],
+            runs,
+            lifts,
+            output_dir,
+        )
+
+
+def write_bundle(task: tuple) -> tuple[tuple[str, int], dict]:
+    """Write one compressed resort bundle.
+
+    Returns the resort's index sort key and index entry. The key is the
+    lowercased name, then the resort's source position so ties sort the
+    same way on every run.
+    """
+    idx, resort_id, feature, name, location, runs, lifts, output_dir = task
+
+    # Build the bundle
+    props = feature.get("properties") or _EMPTY
+    slim_feature = {
+        "type": feature["type"],
+        "geometry": feature.get("geometry"),
+        "properties": {k: v for k, v in props.items() if k in SKI_AREA_PROP_WHITELIST},
+    }
+    bundle = {
+        "resort": slim_feature,
+        "runs": runs,
+        "lifts": lifts,
+    }
+
+    # Write compressed bundle, streaming the compressor output straight to disk
+    bundle_path = output_dir / f"{resort_id}.json.gz"
+    json_bytes = json_dumps(bundle)
+    # Plain blocking writes: bundles are written from every pool worker at
+    # once, so the kernel already sees concurrent writes
+    compressor = GZIP_COMPRESSOR.copy()
+    view = memoryview(json_bytes)
+    with open(bundle_path, "wb") as f:
+        for offset in range(0, len(view), COMPRESS_SLICE_SIZE):
+            f.write(compressor.compress(view[offset : offset + COMPRESS_SLICE_SIZE]))
+        f.write(compressor.flush())
+
+    # Build index entry
+    difficulty_breakdown = compute_difficulty_breakdown(runs)
+
+    entry = {
+        "id": resort_id,
+        "name": name,
+        "latitude": location[0] if location else None,
+        "longitude": location[1] if location else None,
+        "runCount": len(runs),
+        "liftCount": len(lifts),
+        "difficulty": difficulty_breakdown,
+        "status": props.get("status"),
+    }
+
+    # Add elevation data from statistics if available
+    stats = props.get("statistics")
+    if stats:
+        entry["maxElevation"] = stats.get("maxElevation")
+        entry["minElevation"] = stats.get("minElevation")
+
+    return (name.lower(), idx), entry
 
 
 def main():
     parser = argparse.ArgumentParser(description="Split OpenSkiData into per-resort bundles")
     parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT, help="Output directory")
     parser.add_argument("--skip-download", action="store_true", help="Use existing downloaded files")
+    parser.add_argument("--workers", type=int, default=None, help="Bundle writer processes (default: CPU count)")
     args = parser.parse_args()
 
     output_dir = args.output
@@ -133,135 +383,132 @@ def main():
     # Step 1: Download global GeoJSON files
     print("\n=== Step 1: Download GeoJSON ===")
     if not args.skip_download:
-        for name, url in FILES.items():
-            download_file(url, DOWNLOAD_DIR / f"{name}.geojson")
+        # The downloads are independent and network-bound, so run them together
+        with ThreadPoolExecutor(max_workers=len(FILES)) as executor:
+            futures = [
+                executor.submit(download_file, url, DOWNLOAD_DIR / f"{name}.geojson")
+                for name, url in FILES.items()
+            ]
+            for future in futures:
+                future.result()
     else:
         print("  Skipping downloads (--skip-download)")
 
     # Step 2: Parse ski areas
     print("\n=== Step 2: Parse ski areas ===")
     areas_data = load_geojson(DOWNLOAD_DIR / "ski_areas.geojson")
-    resorts = {}
+    # Resorts are stored column-wise, one list per field, indexed by position
+    resort_ids: list[str] = []
+    resort_features: list[dict] = []
+    resort_names: list[str] = []
+    resort_locations: list[tuple[float, float] | None] = []
+    resort_index_map: dict[str, int] = {}
     for feature in areas_data["features"]:
-        props = feature.get("properties", {})
+        props = feature.get("properties") or _EMPTY
         resort_id = props.get("id")
         name = props.get("name")
         if not resort_id or not name:
             continue
 
         # Only include downhill ski areas
-        activities = props.get("activities", [])
-        if "downhill" not in activities:
+        if "downhill" not in (props.get("activities") or ()):
             continue
 
         location = get_resort_location(feature)
-        resorts[resort_id] = {
-            "feature": feature,
-            "name": name,
-            "location": location,
-            "statistics": props.get("statistics"),
-            "status": props.get("status"),
-            "websites": props.get("websites", []),
-            "runConvention": props.get("runConvention"),
-        }
-    print(f"  Found {len(resorts):,} downhill ski areas")
+        idx = resort_index_map.get(resort_id)
+        if idx is None:
+            resort_index_map[resort_id] = len(resort_ids)
+            resort_ids.append(resort_id)
+            resort_features.append(feature)
+            resort_names.append(name)
+            resort_locations.append(location)
+        else:
+            # Duplicate IDs: the last feature wins, as with a dict
+            resort_features[idx] = feature
+            resort_names[idx] = name
+            resort_locations[idx] = location
+    del areas_data  # resort_features keeps the downhill features; drop the rest
+    print(f"  Found {len(resort_ids):,} downhill ski areas")
+
+    # Use the compiled grouping loop when it has been built
+    group = _compiled_group_features or group_features
 
     # Step 3: Parse and group runs by ski area
     print("\n=== Step 3: Parse and group runs ===")
-    runs_data = load_geojson(DOWNLOAD_DIR / "runs.geojson")
-    runs_by_area = defaultdict(list)
-    orphan_runs = 0
-    for feature in runs_data["features"]:
-        area_ids = extract_ski_area_ids(feature)
-        if not area_ids:
-            orphan_runs += 1
-            continue
-        for area_id in area_ids:
-            if area_id in resorts:
-                runs_by_area[area_id].append(feature)
-    print(f"  Grouped runs into {len(runs_by_area):,} resorts ({orphan_runs:,} orphans)")
+    start = time.time()
+    runs_by_area: list[list[dict]] = [[] for _ in resort_ids]
+    runs_count, orphan_runs = group(
+        iter_features(DOWNLOAD_DIR / "runs.geojson"), resort_index_map, runs_by_area
+    )
+    elapsed = time.time() - start
+    area_count = sum(1 for features in runs_by_area if features)
+    print(f"  Grouped {runs_count:,} runs into {area_count:,} resorts ({orphan_runs:,} orphans) in {elapsed:.1f}s")
 
     # Step 4: Parse and group lifts by ski area
     print("\n=== Step 4: Parse and group lifts ===")
-    lifts_data = load_geojson(DOWNLOAD_DIR / "lifts.geojson")
-    lifts_by_area = defaultdict(list)
-    orphan_lifts = 0
-    for feature in lifts_data["features"]:
-        area_ids = extract_ski_area_ids(feature)
-        if not area_ids:
-            orphan_lifts += 1
-            continue
-        for area_id in area_ids:
-            if area_id in resorts:
-                lifts_by_area[area_id].append(feature)
-    print(f"  Grouped lifts into {len(lifts_by_area):,} resorts ({orphan_lifts:,} orphans)")
+    start = time.time()
+    lifts_by_area: list[list[dict]] = [[] for _ in resort_ids]
+    lifts_count, orphan_lifts = group(
+        iter_features(DOWNLOAD_DIR / "lifts.geojson"), resort_index_map, lifts_by_area
+    )
+    elapsed = time.time() - start
+    area_count = sum(1 for features in lifts_by_area if features)
+    print(f"  Grouped {lifts_count:,} lifts into {area_count:,} resorts ({orphan_lifts:,} orphans) in {elapsed:.1f}s")
 
     # Step 5: Write per-resort bundles
     print("\n=== Step 5: Write per-resort bundles ===")
-    index_entries = []
+    keyed_entries = []
     written = 0
-    skipped = 0
 
-    for resort_id, resort_info in resorts.items():
-        runs = runs_by_area.get(resort_id, [])
-        lifts = lifts_by_area.get(resort_id, [])
-
-        # Skip resorts with no runs AND no lifts
-        if not runs and not lifts:
-            skipped += 1
-            continue
-
-        # Build the bundle
-        bundle = {
-            "resort": resort_info["feature"],
-            "runs": runs,
-            "lifts": lifts,
-        }
-
-        # Write compressed bundle
-        bundle_path = output_dir / f"{resort_id}.json.gz"
-        json_bytes = json.dumps(bundle, separators=(",", ":")).encode("utf-8")
-        with gzip.open(bundle_path, "wb") as f:
-            f.write(json_bytes)
-
-        # Build index entry
-        difficulty_breakdown = compute_difficulty_breakdown(runs)
-        location = resort_info["location"]
-
-        entry = {
-            "id": resort_id,
-            "name": resort_info["name"],
-            "latitude": location[0] if location else None,
-            "longitude": location[1] if location else None,
-            "runCount": len(runs),
-            "liftCount": len(lifts),
-            "difficulty": difficulty_breakdown,
-            "status": resort_info["status"],
-        }
-
-        # Add elevation data from statistics if available
-        stats = resort_info.get("statistics")
-        if stats:
-            entry["maxElevation"] = stats.get("maxElevation")
-            entry["minElevation"] = stats.get("minElevation")
-
-        index_entries.append(entry)
-        written += 1
-
-    # Sort index by name
-    index_entries.sort(key=lambda e: e["name"].lower())
+    # Skip resorts with no runs AND no lifts
+    active = [
+        idx for idx in range(len(resort_ids)) if runs_by_area[idx] or lifts_by_area[idx]
+    ]
+    skipped = len(resort_ids) - len(active)
+
+    # Serializing and compressing bundles is CPU-bound, so spread it across cores.
+    # imap (not imap_unordered) keeps results in source order, so resorts with
+    # the same name sort the same way on every run.
+    tasks = iter_bundle_tasks(
+        active,
+        resort_ids,
+        resort_features,
+        resort_names,
+        resort_locations,
+        runs_by_area,
+        lifts_by_area,
+        output_dir,
+    )
+    with multiprocessing.Pool(args.workers) as pool:
+        for keyed_entry in pool.imap(write_bundle, tasks, chunksize=32):
+            keyed_entries.append(keyed_entry)
+            written += 1
+
+    # Sort index by name; workers computed the keys, so sort on them in C
+    keyed_entries.sort(key=itemgetter(0))
+    index_entries = [entry for _, entry in keyed_entries]
 
     print(f"  Wrote {written:,} resort bundles, skipped {skipped:,} empty resorts")
 
     # Step 6: Write resort index
     print("\n=== Step 6: Write resort index ===")
     index_path = output_dir / "resort_index.json"
-    with open(index_path, "w") as f:
-        json.dump(index_entries, f, separators=(",", ":"))
+    with open(index_path, "wb") as f:
+        f.write(json_dumps(index_entries))
 
     index_size = index_path.stat().st_size / 1024
     print(f"  Wrote {index_path} ({index_size:.0f} KB, {len(index_entries):,} resorts)")
 
+    # Columnar copy of the index: one list per field instead of repeating
+    # every key in every entry. resort_index.json stays as-is for existing clients.
+    columns = {key: [e.get(key) for e in index_entries] for key in INDEX_COLUMNS}
+    columnar_path = output_dir / "resort_index_v2.json"
+    with open(columnar_path, "wb") as f:
+        f.write(json_dumps({"version": 2, "columns": columns}))
+
+    columnar_size = columnar_path.stat().st_size / 1024
+    print(f"  Wrote {columnar_path} ({columnar_size:.0f} KB)")
+
     # Summary
     print(f"\n=== Done ===")
     print(f"  Output: {output_dir}")